@@ -0,0 +1,257 @@
+"""
+Cold-storage archive files for sensor readings.
+
+One file per series and UTC day: <ARCHIVE_DIR>/<sensor_name>__<parameter>/<YYYY-MM-DD>.ibsa
+(alert_actions are archived per UTC day as gzip'd JSON lines, see write_actions_day)
+Rows are sorted by time and stored column-wise in blocks:
+
+    header   magic b"IBSA", version u16, reserved u16, rows u32, blocks u32, min_ts i64, max_ts i64
+    index    per block: min_ts i64, max_ts i64, rows u32, ts_bytes u32, value_bytes u32
+    blocks   zlib(shuffled delta-encoded timestamps) + zlib(shuffled float64 values)
+
+Timestamps are microseconds since the epoch (UTC). Header and block index are uncompressed,
+so a range query only decompresses blocks that overlap the requested time range.
+"""
+from __future__ import annotations
+import gzip
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import date, datetime, timedelta, timezone
+
+MAGIC = b"IBSA"
+VERSION = 1
+BLOCK_ROWS = 4096
+HEADER = struct.Struct("<4sHHIIqq")
+BLOCK_ENTRY = struct.Struct("<qqIII")
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_micros(ts: datetime) -> int:
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def series_dir(archive_dir: str, sensor_name: str, parameter: str) -> str:
+    return os.path.join(archive_dir, f"{sensor_name}__{parameter}")
+
+
+def day_path(archive_dir: str, sensor_name: str, parameter: str, day: date) -> str:
+    return os.path.join(series_dir(archive_dir, sensor_name, parameter), f"{day.isoformat()}.ibsa")
+
+
+def _shuffle(raw: bytes, width: int = 8) -> bytes:
+    """Group byte i of every element together; makes slowly changing numbers compress much better."""
+    return b"".join(raw[i::width] for i in range(width))
+
+
+def _unshuffle(data: bytes, width: int = 8) -> bytes:
+    n = len(data) // width
+    out = bytearray(len(data))
+    for i in range(width):
+        out[i::width] = data[i * n:(i + 1) * n]
+    return bytes(out)
+
+
+def _to_le(column: array) -> bytes:
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _from_le(typecode: str, raw: bytes) -> array:
+    column = array(typecode)
+    column.frombytes(raw)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def _encode_block(timestamps: list[int], values: list[float]) -> tuple[bytes, bytes]:
+    deltas = array("q", [timestamps[0]] + [b - a for a, b in zip(timestamps, timestamps[1:])])
+    ts_bytes = zlib.compress(_shuffle(_to_le(deltas)), 9)
+    value_bytes = zlib.compress(_shuffle(_to_le(array("d", values))), 9)
+    return ts_bytes, value_bytes
+
+
+def _decode_block(ts_bytes: bytes, value_bytes: bytes) -> tuple[list[int], array]:
+    deltas = _from_le("q", _unshuffle(zlib.decompress(ts_bytes)))
+    timestamps = []
+    current = 0
+    for delta in deltas:
+        current += delta
+        timestamps.append(current)
+    values = _from_le("d", _unshuffle(zlib.decompress(value_bytes)))
+    return timestamps, values
+
+
+def write_day(path: str, rows: list[tuple[int, float]]):
+    """Write (micros, value) rows to an archive file, merging with an existing file for the same day.
+
+    The file is written next to its final location and renamed into place, so readers never see a partial file.
+    """
+    if os.path.exists(path):
+        rows = list(read_file(path)) + list(rows)
+    merged = sorted(dict(rows).items())  # Dedupe on timestamp, later rows win
+    if not merged:
+        return
+
+    index = []
+    payload = []
+    for start in range(0, len(merged), BLOCK_ROWS):
+        chunk = merged[start:start + BLOCK_ROWS]
+        timestamps = [ts for ts, _ in chunk]
+        ts_bytes, value_bytes = _encode_block(timestamps, [value for _, value in chunk])
+        index.append(BLOCK_ENTRY.pack(timestamps[0], timestamps[-1], len(chunk), len(ts_bytes), len(value_bytes)))
+        payload.append(ts_bytes)
+        payload.append(value_bytes)
+
+    header = HEADER.pack(MAGIC, VERSION, 0, len(merged), len(index), merged[0][0], merged[-1][0])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(b"".join(index))
+        f.write(b"".join(payload))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_file(path: str, start_us: int | None = None, end_us: int | None = None):
+    """Yield (micros, value) rows with start_us <= micros < end_us from one archive file via mmap."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, version, _, _, blocks, min_ts, max_ts = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an IBSA v{VERSION} archive file")
+        if (start_us is not None and max_ts < start_us) or (end_us is not None and min_ts >= end_us):
+            return
+        offset = HEADER.size + blocks * BLOCK_ENTRY.size
+        for i in range(blocks):
+            block_min, block_max, _, ts_len, value_len = BLOCK_ENTRY.unpack_from(mm, HEADER.size + i * BLOCK_ENTRY.size)
+            block_offset = offset
+            offset += ts_len + value_len
+            if (start_us is not None and block_max < start_us) or (end_us is not None and block_min >= end_us):
+                continue
+            timestamps, values = _decode_block(
+                mm[block_offset:block_offset + ts_len],
+                mm[block_offset + ts_len:block_offset + ts_len + value_len],
+            )
+            for ts, value in zip(timestamps, values):
+                if (start_us is None or ts >= start_us) and (end_us is None or ts < end_us):
+                    yield ts, value
+
+
+def write_series_info(archive_dir: str, sensor_name: str, parameter: str, unit: str | None):
+    """Write series.json atomically (temp file + rename); skipped when the contents are unchanged."""
+    path = os.path.join(series_dir(archive_dir, sensor_name, parameter), "series.json")
+    content = json.dumps({"sensor_name": sensor_name, "parameter": parameter, "unit": unit}, ensure_ascii=False)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if f.read() == content:
+                return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def list_series(archive_dir: str) -> list[dict]:
+    """Return the series.json contents of every archived series."""
+    result = []
+    if not os.path.isdir(archive_dir):
+        return result
+    for name in sorted(os.listdir(archive_dir)):
+        info_path = os.path.join(archive_dir, name, "series.json")
+        if os.path.exists(info_path):
+            with open(info_path, encoding="utf-8") as f:
+                result.append(json.load(f))
+    return result
+
+
+def query(archive_dir: str, sensor_name: str, parameter: str, start: datetime, end: datetime):
+    """Yield (recorded_at, value) from the archive for start <= recorded_at < end, in time order.
+
+    Day files outside the range are skipped by name; within a file the header and block index prune further.
+    """
+    directory = series_dir(archive_dir, sensor_name, parameter)
+    if not os.path.isdir(directory):
+        return
+    start_us, end_us = to_micros(start), to_micros(end)
+    first_day = start.astimezone(timezone.utc).date()
+    last_day = end.astimezone(timezone.utc).date()
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".ibsa"):
+            continue
+        day = date.fromisoformat(name[:-len(".ibsa")])
+        if day < first_day or day > last_day:
+            continue
+        for ts, value in read_file(os.path.join(directory, name), start_us, end_us):
+            yield from_micros(ts), value
+
+
+# alert_actions are few, mostly free text rows, so they are kept row-wise as gzip'd JSON lines
+ACTIONS_DIR = "alert_actions"
+ACTION_COLUMNS = ("id", "alert_uid", "alert_title", "state", "threshold", "current_value",
+                  "started_at", "sustained_seconds", "action", "created_at")
+
+
+def actions_day_path(archive_dir: str, day: date) -> str:
+    return os.path.join(archive_dir, ACTIONS_DIR, f"{day.isoformat()}.jsonl.gz")
+
+
+def read_actions_file(path: str) -> list[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_actions_day(path: str, actions: list[dict]):
+    """Write alert_actions rows (datetimes as ISO strings) for one day, merging with an existing file by id.
+
+    Same temp file + fsync + rename as write_day, so a crash never leaves a partial file.
+    """
+    if os.path.exists(path):
+        actions = read_actions_file(path) + list(actions)
+    merged = sorted({a["id"]: a for a in actions}.values(), key=lambda a: (a["created_at"], a["id"]))
+    if not merged:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+            for action in merged:
+                gz.write((json.dumps(action, ensure_ascii=False) + "\n").encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def query_actions(archive_dir: str, start: datetime, end: datetime):
+    """Yield archived alert_actions with start <= created_at < end, in time order (timestamps as datetime)."""
+    directory = os.path.join(archive_dir, ACTIONS_DIR)
+    if not os.path.isdir(directory):
+        return
+    first_day = start.astimezone(timezone.utc).date()
+    last_day = end.astimezone(timezone.utc).date()
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".jsonl.gz"):
+            continue
+        day = date.fromisoformat(name[:-len(".jsonl.gz")])
+        if day < first_day or day > last_day:
+            continue
+        for action in read_actions_file(os.path.join(directory, name)):
+            created_at = datetime.fromisoformat(action["created_at"])
+            if start <= created_at < end:
+                started_at = action["started_at"] and datetime.fromisoformat(action["started_at"])
+                yield {**action, "created_at": created_at, "started_at": started_at}
@@ -0,0 +1,262 @@
+"""
+On-demand sampling profiler and slow-path capture, shared by worker and sensor.
+
+SamplingProfiler samples the stacks of all threads from a daemon thread while enabled and
+writes them in collapsed ("folded") format, readable by flamegraph.pl, speedscope or inferno.
+SlowPathRecorder times webhook requests, DB calls and loop iterations and logs every one that
+exceeds the latency budget together with stacks sampled while it was over budget and the
+timings of nested calls.
+"""
+from __future__ import annotations
+import functools
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))  # Sampling period while enabled
+PROFILE_ON_START = os.getenv("PROFILE_ON_START", "0") == "1"
+SLOW_BUDGET_MS = float(os.getenv("SLOW_BUDGET_MS", "500"))  # 0 disables slow-path capture
+# Helper threads started by this module; they are never part of a profile
+_OWN_THREAD_NAMES = {"sampling-profiler", "profiler-control", "slow-path-watchdog"}
+
+
+def _collapse(frame, root: str) -> str:
+    """Stack of frame as 'root;outer (file:line);...;inner (file:line)'."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})".replace(";", ":"))
+        frame = frame.f_back
+    stack.append(root.replace(";", ":"))
+    return ";".join(reversed(stack))
+
+
+class SamplingProfiler:
+    def __init__(self, name: str, interval_ms: float = PROFILE_INTERVAL_MS, output_dir: str = PROFILE_DIR):
+        self.name = name
+        self.interval = interval_ms / 1000
+        self.output_dir = output_dir
+        self.samples: Counter[str] = Counter()
+        self.started_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> bool:
+        """Start sampling; return False if already running."""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.samples = Counter()
+            self.started_at = datetime.now(timezone.utc)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        print(f"[PROFILER] Sampling started every {self.interval * 1000:g}ms")
+        return True
+
+    def stop(self) -> str | None:
+        """Stop sampling and write the collapsed stacks; return the output path (None if not running)."""
+        with self._lock:
+            if self._thread is None:
+                return None
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        path = self.write()
+        print(f"[PROFILER] Sampling stopped, {sum(self.samples.values())} samples written to {path}")
+        return path
+
+    def toggle(self) -> str | None:
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+    def collapsed(self) -> str:
+        """Samples so far as 'frame;frame;frame count' lines (root first)."""
+        samples = dict(self.samples)  # Snapshot; the sampler thread keeps adding while running
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(samples.items(), key=lambda item: -item[1]))
+
+    def write(self) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = (self.started_at or datetime.now(timezone.utc)).strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.output_dir, f"{self.name}-{stamp}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return path
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, str(thread_id))
+                if thread_id == own_id or name in _OWN_THREAD_NAMES:
+                    continue
+                self.samples[_collapse(frame, name)] += 1
+
+
+class _Span:
+    def __init__(self, kind: str, label: str):
+        self.kind = kind
+        self.label = label
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.children = []
+        self.samples: Counter[str] = Counter()  # Stacks sampled while over budget
+
+
+class SlowPathRecorder:
+    """Times tracked blocks; a watchdog thread samples the stack of every block that is still
+    running past the budget, so a slow entry shows where the time went, not just where it was called."""
+    def __init__(self, budget_ms: float = SLOW_BUDGET_MS, max_entries: int = 50, max_samples: int = 200):
+        self.budget_ms = budget_ms
+        self.entries = deque(maxlen=max_entries)
+        self.max_samples = max_samples
+        self.sample_interval = max(budget_ms / 5, 10) / 1000
+        self._local = threading.local()
+        self._active: dict[int, _Span] = {}
+        self._active_lock = threading.Lock()
+        self._watchdog = None
+
+    @contextmanager
+    def track(self, kind: str, label: str):
+        """Time the enclosed block; nested track() calls show up as child timings of the outer one."""
+        if self.budget_ms <= 0:
+            yield
+            return
+        if self._watchdog is None:
+            self._start_watchdog()
+        spans = getattr(self._local, "spans", None)
+        if spans is None:
+            spans = self._local.spans = []
+        span = _Span(kind, label)
+        spans.append(span)
+        with self._active_lock:
+            self._active[id(span)] = span
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - span.start) * 1000
+            with self._active_lock:
+                del self._active[id(span)]
+            spans.pop()
+            if spans:
+                spans[-1].children.append((kind, label, elapsed_ms))
+            if elapsed_ms > self.budget_ms:
+                self._record(span, elapsed_ms)
+
+    def timed(self, kind: str, label: str):
+        """Decorator form of track()."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.track(kind, label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _start_watchdog(self):
+        with self._active_lock:
+            if self._watchdog is not None:
+                return
+            self._watchdog = threading.Thread(target=self._watch, name="slow-path-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.sample_interval)
+            now = time.perf_counter()
+            with self._active_lock:
+                overdue = [span for span in self._active.values() if (now - span.start) * 1000 > self.budget_ms]
+            if not overdue:
+                continue
+            frames = sys._current_frames()
+            for span in overdue:
+                frame = frames.get(span.thread_id)
+                if frame is not None and sum(span.samples.values()) < self.max_samples:
+                    span.samples[_collapse(frame, f"{span.kind} {span.label}")] += 1
+
+    def _record(self, span: _Span, elapsed_ms: float):
+        samples = dict(span.samples)
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "kind": span.kind,
+            "label": span.label,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "budget_ms": self.budget_ms,
+            "children": [{"kind": k, "label": l, "elapsed_ms": round(ms, 1)} for k, l, ms in span.children],
+            # Collapsed stacks sampled while the block was over budget, most frequent first
+            "samples": [{"stack": stack, "count": count} for stack, count in sorted(samples.items(), key=lambda item: -item[1])],
+            "call_site": traceback.format_stack()[:-3],  # Drop contextmanager/_record frames
+        }
+        self.entries.append(entry)
+        print(f"[SLOW] {span.kind} '{span.label}' took {elapsed_ms:.1f}ms (budget {self.budget_ms:g}ms)")
+        for child in entry["children"]:
+            print(f"[SLOW]   {child['kind']} '{child['label']}': {child['elapsed_ms']}ms")
+        for sample in entry["samples"][:3]:
+            print(f"[SLOW]   {sample['count']}x in " + " <- ".join(reversed(sample["stack"].split(";")[-4:])))
+        if not entry["samples"]:
+            print("[SLOW]   at " + "".join(entry["call_site"][-4:]).strip())
+
+
+def timed_connection_class(recorder: SlowPathRecorder):
+    """psycopg connection class that reports every execute() and commit() to the recorder.
+
+    Use TimedConnection.connect(...) instead of psycopg.connect(...); commit is where the WAL fsync happens.
+    """
+    import psycopg
+
+    class TimedCursor(psycopg.Cursor):
+        def execute(self, query, params=None, **kwargs):
+            label = " ".join(str(query).split())[:80]
+            with recorder.track("db", label):
+                return super().execute(query, params, **kwargs)
+
+    class TimedConnection(psycopg.Connection):
+        @classmethod
+        def connect(cls, conninfo: str = "", **kwargs):
+            kwargs.setdefault("cursor_factory", TimedCursor)
+            return super().connect(conninfo, **kwargs)
+
+        def commit(self):
+            with recorder.track("db", "COMMIT"):
+                return super().commit()
+
+    return TimedConnection
+
+
+def install_signal_toggle(profiler: SamplingProfiler, signum: int | None = None):
+    """Toggle the profiler on SIGUSR1 (kill -USR1 <pid> / docker kill -s USR1 <container>).
+
+    The handler only sets an event: join, file I/O and print happen on a separate control thread,
+    because the interrupted main thread may itself be in the middle of a print or a start()/stop().
+    """
+    signum = signum or getattr(signal, "SIGUSR1", None)
+    if signum is None:  # Not available on Windows
+        return
+    requested = threading.Event()
+
+    def control():
+        while True:
+            requested.wait()
+            requested.clear()
+            try:
+                profiler.toggle()
+            except Exception as e:
+                print(f"[PROFILER] ⚠️ ERROR toggling profiler: {type(e).__name__}: {e}")
+
+    threading.Thread(target=control, name="profiler-control", daemon=True).start()
+    signal.signal(signum, lambda *_: requested.set())
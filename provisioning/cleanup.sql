@@ -1,19 +1,17 @@
 -- Database Cleanup Script
 -- Runs daily to prevent database from growing indefinitely
 
--- Delete sensor readings older than 7 days
-DELETE FROM sensor_readings WHERE recorded_at < NOW() - INTERVAL '7 days';
-
--- Delete alert actions older than 30 days
-DELETE FROM alert_actions WHERE created_at < NOW() - INTERVAL '30 days';
+-- Nothing is deleted here: the tiering service (archive/tiering.py) moves readings older
+-- than HOT_DAYS and alert actions older than ACTIONS_HOT_DAYS into archive files and
+-- deletes them afterwards.
 
 -- Show cleanup results
 SELECT 
-    'sensor_readings' as table_name,
+    'readings' as table_name,
     COUNT(*) as remaining_rows,
     MIN(recorded_at) as oldest_record,
     MAX(recorded_at) as newest_record
-FROM sensor_readings
+FROM readings
 UNION ALL
 SELECT 
     'alert_actions' as table_name,
@@ -1,13 +1,32 @@
-CREATE TABLE IF NOT EXISTS sensor_readings (
-    id BIGSERIAL PRIMARY KEY,
+-- Series dictionary: one row per sensor line + parameter, resolved once by each sensor at startup
+CREATE TABLE IF NOT EXISTS series (
+    id SMALLSERIAL PRIMARY KEY,
     sensor_name TEXT NOT NULL,
     parameter TEXT NOT NULL,
-    value DOUBLE PRECISION NOT NULL,
     unit TEXT,
-    recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    threshold_low DOUBLE PRECISION,
+    threshold_high DOUBLE PRECISION,
+    UNIQUE (sensor_name, parameter)
+);
+
+-- Narrow readings table (columns ordered widest first to avoid alignment padding)
+CREATE TABLE IF NOT EXISTS readings (
+    recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    value DOUBLE PRECISION NOT NULL,
+    series_id SMALLINT NOT NULL REFERENCES series (id),
+    PRIMARY KEY (series_id, recorded_at)
 );
 
-CREATE INDEX IF NOT EXISTS idx_sensor_time ON sensor_readings (sensor_name, recorded_at DESC);
+-- Tiny block-range index for time-range scans across all series (e.g. cleanup)
+CREATE INDEX IF NOT EXISTS idx_readings_time_brin ON readings USING BRIN (recorded_at);
+
+-- Old row shape for compatibility (ad-hoc queries, external tools)
+-- The old id column is intentionally not part of the view: a row_number() surrogate would not be stable
+-- and would force a full sort on every query. Order by recorded_at instead.
+CREATE OR REPLACE VIEW sensor_readings AS
+SELECT s.sensor_name, s.parameter, r.value, s.unit, r.recorded_at
+FROM readings r
+JOIN series s ON s.id = r.series_id;
 
 -- Table to log actions taken by worker when sustained alerts occur
 CREATE TABLE IF NOT EXISTS alert_actions (
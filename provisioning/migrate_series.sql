@@ -0,0 +1,51 @@
+-- One-time migration for databases created before the series/readings layout
+-- (init.sql only runs on an empty volume). Run once:
+--   docker exec -i ibsys_postgres psql -U sensor -d sensor_db < provisioning/migrate_series.sql
+-- Stop the sensor containers first; they need the new schema after this.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS series (
+    id SMALLSERIAL PRIMARY KEY,
+    sensor_name TEXT NOT NULL,
+    parameter TEXT NOT NULL,
+    unit TEXT,
+    threshold_low DOUBLE PRECISION,
+    threshold_high DOUBLE PRECISION,
+    UNIQUE (sensor_name, parameter)
+);
+
+CREATE TABLE IF NOT EXISTS readings (
+    recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    value DOUBLE PRECISION NOT NULL,
+    series_id SMALLINT NOT NULL REFERENCES series (id),
+    PRIMARY KEY (series_id, recorded_at)
+);
+
+-- Thresholds are filled in by the sensors on their next start
+INSERT INTO series (sensor_name, parameter, unit)
+SELECT DISTINCT ON (sensor_name, parameter) sensor_name, parameter, unit
+FROM sensor_readings
+ORDER BY sensor_name, parameter, recorded_at DESC
+ON CONFLICT (sensor_name, parameter) DO NOTHING;
+
+INSERT INTO readings (recorded_at, value, series_id)
+SELECT sr.recorded_at, sr.value, s.id
+FROM sensor_readings sr
+JOIN series s ON s.sensor_name = sr.sensor_name AND s.parameter = sr.parameter
+ON CONFLICT (series_id, recorded_at) DO NOTHING;
+
+DROP TABLE sensor_readings;
+
+CREATE INDEX IF NOT EXISTS idx_readings_time_brin ON readings USING BRIN (recorded_at);
+
+-- The old id column is intentionally not part of the view: a row_number() surrogate would not be stable
+-- and would force a full sort on every query. Order by recorded_at instead.
+CREATE OR REPLACE VIEW sensor_readings AS
+SELECT s.sensor_name, s.parameter, r.value, s.unit, r.recorded_at
+FROM readings r
+JOIN series s ON s.id = r.series_id;
+
+COMMIT;
+
+VACUUM ANALYZE readings;
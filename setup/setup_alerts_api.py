@@ -11,6 +11,7 @@ import os
 
 GRAFANA_URL = os.getenv("GRAFANA_URL", "http://localhost:3000")
 AUTH = ("admin", "admin")
+SENSOR_NAME = os.getenv("SENSOR_NAME", "lackieranlage_1")  # Line whose series the rules watch
 
 # Alert rule definitions
 ALERT_RULES = [
@@ -177,7 +178,7 @@ def create_alert_rule(rule_def, datasource_uid, folder_uid):
                     "editorMode": "code",
                     "format": "table",
                     "rawQuery": True,
-                    "rawSql": f"SELECT NOW() as time, value FROM sensor_readings WHERE parameter='{rule_def['parameter']}' ORDER BY recorded_at DESC LIMIT 1",
+                    "rawSql": f"SELECT NOW() as time, value FROM readings WHERE series_id = (SELECT id FROM series WHERE sensor_name='{SENSOR_NAME}' AND parameter='{rule_def['parameter']}') ORDER BY recorded_at DESC LIMIT 1",
                     "refId": "A",
                     "sql": {
                         "columns": [{"parameters": [], "type": "function"}],
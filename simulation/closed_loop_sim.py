@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Closed-Loop Simulation Harness
+Runs the sensor AnomalySimulator and the worker AlertDurationManager against a
+virtual clock, an in-memory alert_actions table and a model of the Grafana rules
+from setup_alerts_api.py, so thousands of anomaly episodes run in seconds.
+
+Usage (needs sensor/requirements.txt installed, no database or Grafana):
+    python simulation/closed_loop_sim.py --episodes 1000 --buildup-seconds 10 30 --alert-duration 20 30 --poll-interval 1 15
+"""
+import argparse
+import contextlib
+import heapq
+import importlib
+import itertools
+import os
+import random
+import re
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "sensor"))
+sys.path.insert(0, os.path.join(ROOT, "worker"))
+sys.path.insert(0, os.path.join(ROOT, "common"))
+
+from alert_logic import AlertDurationManager
+
+# Sensor services as configured in docker-compose.yml
+SENSOR_PROFILES = {
+    "kabinentemperatur": {
+        "WRITE_INTERVAL_SECONDS": "5", "UNIT": "°C", "MIN_VALUE": "18", "MAX_VALUE": "30",
+        "THRESHOLD_HIGH": "28", "THRESHOLD_LOW": "18", "ANOMALY_CYCLE_MINUTES": "0.5",
+        "BUILDUP_SECONDS": "10", "RECOVERY_SECONDS": "15",
+    },
+    "luftfeuchtigkeit": {
+        "WRITE_INTERVAL_SECONDS": "6", "UNIT": "%", "MIN_VALUE": "25", "MAX_VALUE": "70",
+        "THRESHOLD_HIGH": "65", "THRESHOLD_LOW": "30", "ANOMALY_CYCLE_MINUTES": "0.7",
+        "BUILDUP_SECONDS": "12", "RECOVERY_SECONDS": "18",
+    },
+    "duesendruck": {
+        "WRITE_INTERVAL_SECONDS": "4", "UNIT": "bar", "MIN_VALUE": "1.5", "MAX_VALUE": "3.5",
+        "THRESHOLD_HIGH": "3.2", "THRESHOLD_LOW": "1.8", "ANOMALY_CYCLE_MINUTES": "0.8",
+        "BUILDUP_SECONDS": "12", "RECOVERY_SECONDS": "15",
+    },
+    "energieverbrauch": {
+        "WRITE_INTERVAL_SECONDS": "8", "UNIT": "kW", "MIN_VALUE": "15", "MAX_VALUE": "25",
+        "THRESHOLD_HIGH": "28", "THRESHOLD_LOW": "12", "ANOMALY_CYCLE_MINUTES": "0.6",
+        "BUILDUP_SECONDS": "12", "RECOVERY_SECONDS": "18",
+    },
+}
+
+# Alert title prefixes as used in setup_alerts_api.py ALERT_RULES
+PARAMETER_TITLES = {
+    "kabinentemperatur": "Kabinentemperatur",
+    "luftfeuchtigkeit": "Luftfeuchtigkeit",
+    "duesendruck": "Düsendruck",
+    "energieverbrauch": "Energieverbrauch",
+}
+
+ACTION_LOOKBACK_SECONDS = 120  # Same window as AnomalySimulator.fetch_recent_action ('2 minutes')
+
+
+class VirtualClock:
+    """Clock that only advances when the event loop says so"""
+    def __init__(self, start: float = 1_700_000_000.0):
+        self.t = start
+
+    def time(self) -> float:
+        return self.t
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.t, timezone.utc)
+
+
+class EventLoop:
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.queue = []
+        self.seq = itertools.count()  # Tie-breaker keeps same-time events in scheduling order
+
+    def schedule(self, delay: float, callback):
+        heapq.heappush(self.queue, (self.clock.t + delay, next(self.seq), callback))
+
+    def run(self, until: float, stop):
+        while self.queue and not stop():
+            at, _, callback = heapq.heappop(self.queue)
+            if at > until:
+                break
+            self.clock.t = at
+            callback()
+
+
+class InMemoryActionStore:
+    """Stands in for the alert_actions table (rows are appended in created_at order)"""
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.rows = []  # (id, created_at, alert_uid, alert_title, action)
+
+    def insert(self, alert_uid: str, alert_title: str, action: str) -> int:
+        action_id = len(self.rows) + 1
+        self.rows.append((action_id, self.clock.time(), alert_uid, alert_title, action))
+        return action_id
+
+    def fetch_recent_action(self, search_pattern):
+        now = self.clock.time()
+        for action_id, created_at, _, alert_title, action in reversed(self.rows):
+            if now - created_at >= ACTION_LOOKBACK_SECONDS:
+                break
+            if re.search(search_pattern, alert_title, re.IGNORECASE):
+                return action_id, datetime.fromtimestamp(created_at, timezone.utc), action
+        return None
+
+
+class GrafanaRule:
+    """One alert rule from setup_alerts_api.py: last reading vs threshold with a 'for' pending period"""
+    def __init__(self, title: str, threshold: float, operator: str, pending_seconds: float):
+        self.title = title
+        self.uid = title.lower().replace(" ", "_").replace("ü", "ue").replace("ö", "oe")
+        self.threshold = threshold
+        self.operator = operator
+        self.pending_seconds = pending_seconds
+        self.state = "normal"  # normal, pending, firing
+        self.pending_since = None
+        self.last_value = None
+        self.notifying = False
+        self.episode = None  # Episode this firing belongs to (set when the rule starts firing)
+
+    def evaluate(self, value, now: float) -> bool:
+        """Update rule state; return True if the rule just started firing."""
+        if value is None:  # noDataState: OK
+            self.state, self.pending_since = "normal", None
+            return False
+        self.last_value = value
+        breached = value > self.threshold if self.operator == "gt" else value < self.threshold
+        if not breached:
+            self.state, self.pending_since = "normal", None
+            return False
+        if self.state == "normal":
+            self.state, self.pending_since = "pending", now
+        if self.state == "pending" and now - self.pending_since >= self.pending_seconds:
+            self.state = "firing"
+            return True
+        return False
+
+
+@dataclass
+class Episode:
+    started_at: float
+    anomaly_type: str
+    violation_at: float | None = None  # First reading beyond the threshold
+    first_action_at: float | None = None
+    recovery_at: float | None = None
+    ended_at: float | None = None
+    actions: int = 0
+    stale_recovery: bool = False  # Recovery triggered by an action that does not belong to this episode
+
+
+@dataclass
+class Settings:
+    parameter: str
+    buildup_seconds: int
+    alert_duration: int
+    poll_interval: float
+    write_interval: int
+    eval_interval: float = 10
+    pending_seconds: float = 20
+    group_wait: float = 5
+    repeat_interval: float = 10
+
+
+def load_sensor_module(settings: Settings):
+    """(Re)import sensor_realistic with its environment configuration for these settings."""
+    env = dict(SENSOR_PROFILES[settings.parameter])
+    env.update({
+        "PARAMETER": settings.parameter,
+        "BUILDUP_SECONDS": str(settings.buildup_seconds),
+        "ACTION_POLL_SECONDS": str(settings.poll_interval),
+        "WRITE_INTERVAL_SECONDS": str(settings.write_interval),
+    })
+    os.environ.update(env)
+    import sensor_realistic
+    return importlib.reload(sensor_realistic)
+
+
+class ClosedLoopRun:
+    def __init__(self, sensor_module, settings: Settings, seed: int):
+        self.settings = settings
+        self.clock = VirtualClock()
+        self.loop = EventLoop(self.clock)
+        self.store = InMemoryActionStore(self.clock)
+        self.manager = AlertDurationManager(settings.alert_duration, clock=self.clock.now)
+        self.sensor = sensor_module.AnomalySimulator(None, clock=self.clock.time, rng=random.Random(seed))
+        self.sensor.fetch_recent_action = self.fetch_recent_action
+        self.threshold_high = sensor_module.THRESHOLD_HIGH
+        self.threshold_low = sensor_module.THRESHOLD_LOW
+        prefix = PARAMETER_TITLES[settings.parameter]
+        self.rules = [
+            GrafanaRule(f"{prefix} zu hoch", self.threshold_high, "gt", settings.pending_seconds),
+            GrafanaRule(f"{prefix} zu niedrig", self.threshold_low, "lt", settings.pending_seconds),
+        ]
+        self.latest_value = None
+        self.current = None
+        self.completed = []
+        self.action_episodes = {}  # action id -> Episode it was written for (None if no matching episode)
+        self.unattributed_actions = 0
+        self.seen_action_id = None  # Action returned by the sensor's last alert_actions lookup in this tick
+
+    def run(self, episodes: int, horizon_seconds: float):
+        self.loop.schedule(0, self.sensor_tick)
+        self.loop.schedule(self.settings.eval_interval, self.grafana_evaluate)
+        self.loop.run(self.clock.t + horizon_seconds, lambda: len(self.completed) >= episodes)
+        return self.completed, self.current
+
+    def sensor_tick(self):
+        """One iteration of the sensor main loop: next value, write, sleep"""
+        previous = self.sensor.state
+        self.seen_action_id = None
+        value = self.sensor.get_next_value()
+        self.latest_value = value
+        now = self.clock.time()
+        state = self.sensor.state
+        if previous == "normal" and state == "buildup":
+            self.current = Episode(now, self.sensor.anomaly_type)
+        episode = self.current
+        if episode is not None:
+            if episode.violation_at is None and (value > self.threshold_high or value < self.threshold_low):
+                episode.violation_at = now
+            if previous != "recovery" and state == "recovery":
+                episode.recovery_at = now
+                episode.stale_recovery = self.action_episodes.get(self.seen_action_id) is not episode
+            if previous == "recovery" and state == "normal":
+                episode.ended_at = now
+                self.completed.append(episode)
+        self.loop.schedule(self.settings.write_interval, self.sensor_tick)
+
+    def grafana_evaluate(self):
+        now = self.clock.time()
+        for rule in self.rules:
+            if rule.evaluate(self.latest_value, now):
+                rule.episode = self.matching_episode(rule)
+                if not rule.notifying:
+                    rule.notifying = True
+                    self.loop.schedule(self.settings.group_wait, lambda rule=rule: self.notify(rule))
+        self.loop.schedule(self.settings.eval_interval, self.grafana_evaluate)
+
+    def matching_episode(self, rule: GrafanaRule):
+        """The open episode this rule's firing is about: same direction and already in violation."""
+        episode = self.current
+        direction = "high" if rule.operator == "gt" else "low"
+        if (episode is None or episode.ended_at is not None or episode.anomaly_type != direction
+                or episode.violation_at is None):
+            return None
+        return episode
+
+    def fetch_recent_action(self, search_pattern):
+        result = self.store.fetch_recent_action(search_pattern)
+        self.seen_action_id = result[0] if result else None
+        return result
+
+    def notify(self, rule: GrafanaRule):
+        status = "firing" if rule.state == "firing" else "resolved"
+        self.webhook(rule, status)
+        if status == "firing":
+            self.loop.schedule(self.settings.repeat_interval, lambda: self.notify(rule))
+        else:
+            rule.notifying = False
+
+    def webhook(self, rule: GrafanaRule, status: str):
+        """Same decision path as worker.grafana_webhook for a single alert"""
+        should_act = self.manager.process(rule.uid, rule.title, rule.threshold, rule.last_value, status)
+        if not should_act:
+            return
+        alert_state = self.manager.get_alert_state(rule.uid)
+        if alert_state and alert_state.action_written:
+            return
+        self.manager.mark_action_written(rule.uid)
+        action_id = self.store.insert(rule.uid, rule.title, f"Alarm: {rule.title}")
+        # Credit the action to the episode the firing started in, never to whichever episode is newest
+        episode = rule.episode
+        self.action_episodes[action_id] = episode
+        if episode is None:
+            self.unattributed_actions += 1
+            return
+        now = self.clock.time()
+        assert now >= episode.violation_at, "action credited to an episode before its threshold violation"
+        episode.actions += 1
+        if episode.first_action_at is None:
+            episode.first_action_at = now
+
+
+def _percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _describe(values):
+    if not values:
+        return "n/a"
+    mean = sum(values) / len(values)
+    return f"mean {mean:5.1f}s p50 {_percentile(values, 0.5):5.1f}s p95 {_percentile(values, 0.95):5.1f}s max {max(values):5.1f}s"
+
+
+def simulate(settings: Settings, episodes: int, seed: int) -> dict:
+    sensor_module = load_sensor_module(settings)
+    run = ClosedLoopRun(sensor_module, settings, seed)
+    # Worst case per episode: normal phase + buildup + recovery + 10 minutes waiting for an action
+    budget = sensor_module.ANOMALY_CYCLE_MINUTES * 60 + settings.buildup_seconds + sensor_module.RECOVERY_SECONDS + 600
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        completed, open_episode = run.run(episodes, episodes * budget)
+
+    reaction = [e.recovery_at - e.violation_at for e in completed if e.violation_at is not None]
+    action_latency = [e.first_action_at - e.violation_at for e in completed
+                      if e.first_action_at is not None and e.violation_at is not None]
+    return {
+        "episodes": len(completed),
+        "stuck": 1 if open_episode is not None and open_episode.ended_at is None and len(completed) < episodes else 0,
+        "reaction": reaction,
+        "action_latency": action_latency,
+        "actions": sum(e.actions for e in completed),
+        "duplicates": sum(max(0, e.actions - 1) for e in completed),
+        "episodes_with_duplicates": sum(1 for e in completed if e.actions > 1),
+        "stale_recoveries": sum(1 for e in completed if e.stale_recovery),
+        "unattributed_actions": run.unattributed_actions,
+        "virtual_seconds": run.clock.t - VirtualClock().t,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic closed-loop simulation of sensor -> Grafana -> worker -> sensor")
+    parser.add_argument("--parameter", choices=sorted(SENSOR_PROFILES), default="kabinentemperatur")
+    parser.add_argument("--episodes", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--buildup-seconds", type=int, nargs="+", help="BUILDUP_SECONDS values (default: docker-compose)")
+    parser.add_argument("--alert-duration", type=int, nargs="+", default=[20], help="ALERT_DURATION_SECONDS values")
+    parser.add_argument("--poll-interval", type=float, nargs="+", default=[1], help="ACTION_POLL_SECONDS values; the sensor polls at most once per write, so only "
+                             "values above the write interval change the result")
+    parser.add_argument("--write-interval", type=int, nargs="+", help="WRITE_INTERVAL_SECONDS values (default: docker-compose)")
+    parser.add_argument("--eval-interval", type=float, default=10, help="Grafana rule evaluation interval")
+    parser.add_argument("--pending-seconds", type=float, default=20, help="Grafana rule 'for' period")
+    args = parser.parse_args()
+
+    profile = SENSOR_PROFILES[args.parameter]
+    buildups = args.buildup_seconds or [int(profile["BUILDUP_SECONDS"])]
+    write_intervals = args.write_interval or [int(profile["WRITE_INTERVAL_SECONDS"])]
+
+    print("=" * 70)
+    print(f"IBSYS II - Closed-Loop Simulation ({args.parameter}, {args.episodes} episodes, seed {args.seed})")
+    print("=" * 70)
+    for buildup, duration, poll, write in itertools.product(buildups, args.alert_duration, args.poll_interval, write_intervals):
+        settings = Settings(args.parameter, buildup, duration, poll, write,
+                            eval_interval=args.eval_interval, pending_seconds=args.pending_seconds)
+        result = simulate(settings, args.episodes, args.seed)
+        print(f"\n[SIM] buildup={buildup}s duration={duration}s poll={poll:g}s write={write}s "
+              f"-> {result['episodes']} episodes in {result['virtual_seconds'] / 3600:.1f}h virtual time"
+              + (" (STUCK: episode never recovered)" if result["stuck"] else ""))
+        print(f"      reaction (threshold -> recovery): {_describe(result['reaction'])}")
+        print(f"      action latency (threshold -> action): {_describe(result['action_latency'])}")
+        print(f"      actions {result['actions']}, duplicates {result['duplicates']} "
+              f"in {result['episodes_with_duplicates']} episodes, stale recoveries {result['stale_recoveries']}, "
+              f"unattributed actions {result['unattributed_actions']}")
+
+
+if __name__ == "__main__":
+    main()
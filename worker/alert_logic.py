@@ -1,6 +1,11 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime, timezone
+from typing import Callable
+
+def utc_now() -> datetime:
+    """Default wall clock; replaced by a virtual clock in simulation/closed_loop_sim.py."""
+    return datetime.now(timezone.utc)
 
 @dataclass
 class AlertState:
@@ -28,15 +33,16 @@ class AlertState:
         self.action_written = False  # Reset action flag when alert clears
 
 class AlertDurationManager:
-    def __init__(self, duration_required: int):
+    def __init__(self, duration_required: int, clock: Callable[[], datetime] = utc_now):
         self.duration_required = duration_required
+        self.clock = clock
         self.states: dict[str, AlertState] = {}
 
     def process(self, alert_uid: str, title: str, threshold: float | None, current_value: float, status: str) -> bool:
         """Return True if sustained duration exceeded and action should run.
         status: firing | normal
         """
-        now = datetime.now(timezone.utc)
+        now = self.clock()
         if status != 'firing':
             # reset state if recovered
             if alert_uid in self.states: